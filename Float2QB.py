@@ -1,34 +1,113 @@
 # Script to import CSV to QB.
 
 import click
+import contextlib
 import csv
+import functools
+import itertools
+import json
 import locale
+import operator
 import os
-import re
 import sys
+import tempfile
+import time
 import traceback
 from datetime import datetime
 from pathlib import Path
+from typing import Any, Callable, Iterable, Iterator, NamedTuple
 from win32com.client import Dispatch
 
 import QBComTypes as qb
 
+# number of add requests sent to QuickBooks in each DoRequests call
+BATCH_SIZE = 200
+
+# QuickBooks accounts and memos that every imported transaction uses
+FLOAT_ACCOUNT = "Float Financial"
+AP_ACCOUNT = "Accounts Payable"
+GST_ACCOUNT = "GST Accounts Receivable"
+GST_MEMO = "Half of the GST"
+
+# read buffer for the CSV passes, so large exports take fewer read calls
+READ_BUFFER_SIZE = 1 << 20
+
+# account and vendor lists are cached on disk, by default for this many minutes
+LISTS_CACHE_PATH = Path("~/.float2qb/lists.json").expanduser()
+LISTS_CACHE_TTL = 60
+
+# lists already loaded by this run, keyed by company file
+LOADED_LISTS: dict[str, tuple[frozenset[str], frozenset[str]]] = {}
+
 def Error(message: str):
     """Log errors to stderr with traceback."""
     click.secho(f"Error: {message}", fg='red', err=True)
-    if click.get_current_context().params['debug']:
+    # only print a traceback if there is an exception being handled
+    if click.get_current_context().params['debug'] and sys.exc_info()[0] is not None:
         click.secho(traceback.format_exc(), fg='red', err=True)
 
-def KeysLower(inDict: dict) -> dict:
-    return {k.lower(): KeysLower(v) if isinstance(v, dict) else v for k, v in inDict.items()}
+def ReadColumns(inputFilePath: Path) -> dict[str, int]:
+    """Map each lower-cased CSV column name to its index in a row."""
+    with open(inputFilePath, "r", newline="", encoding="utf-8-sig") as inputFile:
+        header = next(csv.reader(inputFile), [])
+
+    return {name.lower(): i for i, name in enumerate(header)}
+
+def ReadTransactions(inputFilePath: Path) -> Iterator[list[str]]:
+    """Lazily yield the data rows of a CSV file, skipping the header and blank lines."""
+    with open(inputFilePath, "r", buffering=READ_BUFFER_SIZE, newline="", encoding="utf-8-sig") as inputFile:
+        csvReader = csv.reader(inputFile)
+        next(csvReader, None)
+        for row in csvReader:
+            if row:
+                yield row
+
+def ParseTransactionDate(value: str) -> datetime:
+    """Parse a transaction timestamp such as 2024-03-15 12:34:56.123456+0000."""
+    return datetime.fromisoformat(value)
+
+@functools.lru_cache(maxsize=4096)
+def ParseAmount(value: str) -> float:
+    """Convert a CSV amount to a float, treating an empty cell as zero and remembering repeated amounts."""
+    return float(value) if value else 0.0
+
+@functools.lru_cache(maxsize=4096)
+def ParseExpenseDate(value: str) -> datetime:
+    """Parse a reimbursement expense date in DD/MM/YYYY form, remembering repeated dates."""
+    try:
+        day, month, year = value.split("/")
+        return datetime(int(year), int(month), int(day))
+    except ValueError:
+        raise ValueError(f'Invalid expense date "{value}", expected DD/MM/YYYY') from None
+
+@functools.lru_cache(maxsize=4096)
+def FormatCurrency(amount: float) -> str:
+    """Format an amount in the current locale's currency, remembering repeated amounts."""
+    return locale.currency(amount, grouping=True)
+
+def NewMsgSetRequest(sessionManager: qb.IQBSessionManager) -> qb.IMsgSetRequest:
+    """Create an empty request message set that continues past errors."""
+    requestMsgSet = sessionManager.CreateMsgSetRequest("CA", 16, 0)
+    requestMsgSet.Attributes.OnError = qb.constants.roeContinue
+    return requestMsgSet
+
+def SubmitRequests(sessionManager: qb.IQBSessionManager, requestMsgSet: qb.IMsgSetRequest) -> bool:
+    """Send a batch of requests to QuickBooks and walk the responses."""
+    respMsgSet = qb.IMsgSetResponse(sessionManager.DoRequests(requestMsgSet))
+    if WalkRs(respMsgSet):
+        return True
+
+    # a rejected add may be down to an account or vendor renamed or made inactive
+    # since the lists were cached, so query them again next time
+    ForgetLists(sessionManager)
+    return False
 
 def LoadListsFromQB(
     sessionManager: qb.IQBSessionManager,
-) -> tuple[list[str], list[str]]:
+) -> tuple[frozenset[str], frozenset[str]]:
     """Load lists from QuickBooks."""
 
-    requestMsgSet = sessionManager.CreateMsgSetRequest("CA", 16, 0)
-    requestMsgSet.Attributes.OnError = qb.constants.roeContinue
+    requestMsgSet = NewMsgSetRequest(sessionManager)
 
     accountQueryRq = requestMsgSet.AppendAccountQueryRq()
     accountQueryRq.ORAccountListQuery.AccountListFilter.ActiveStatus.SetValue(
@@ -45,21 +124,102 @@ def LoadListsFromQB(
     acctList = qb.IAccountRetList(responseMsgSet.ResponseList.GetAt(0).Detail)
     vendorList = qb.IVendorRetList(responseMsgSet.ResponseList.GetAt(1).Detail)
 
-    validAccounts = [acct.FullName.GetValue() for acct in acctList]
-    validVendors = [vendor.Name.GetValue() for vendor in vendorList]
+    validAccounts = frozenset(acct.FullName.GetValue() for acct in acctList)
+    validVendors = frozenset(vendor.Name.GetValue() for vendor in vendorList)
 
     return validAccounts, validVendors
 
+def ReadListsCache() -> dict:
+    """Read the cached QuickBooks lists, or an empty cache if there isn't a usable one."""
+    try:
+        with open(LISTS_CACHE_PATH, "r", encoding="utf-8") as cacheFile:
+            cache = json.load(cacheFile)
+    except (OSError, ValueError):
+        return {}
 
-def VerifyCSVKeys(transactions: list[dict], reimbursement: bool, maxSplits: int | None = None) -> bool:
-    """Verify that all required keys exist in the CSV transactions."""
-    if not transactions:
-        Error("No transactions found in CSV")
-        return False
+    return cache if isinstance(cache, dict) else {}
+
+def WriteListsCache(cache: dict) -> None:
+    """Atomically replace the cached QuickBooks lists."""
+    tempName = None
+    try:
+        LISTS_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            "w", encoding="utf-8", dir=LISTS_CACHE_PATH.parent, delete=False
+        ) as tempFile:
+            tempName = tempFile.name
+            json.dump(cache, tempFile)
+        os.replace(tempName, LISTS_CACHE_PATH)
+    except OSError:
+        # the cache is only an optimization, so a failed write isn't fatal,
+        # but don't leave the half-written temp file behind
+        if tempName is not None:
+            with contextlib.suppress(OSError):
+                os.unlink(tempName)
+
+def LoadCachedLists(
+    sessionManager: qb.IQBSessionManager,
+    companyFile: str,
+) -> tuple[frozenset[str], frozenset[str]]:
+    """Load lists from the on-disk cache, falling back to QuickBooks when stale."""
+    params = click.get_current_context().params
+    refresh = params['refresh_lists']
+    maxAge = params['lists_ttl'] * 60
+
+    cache = ReadListsCache()
+    entry = cache.get(companyFile)
+    if not refresh and entry:
+        try:
+            if time.time() - entry["timestamp"] < maxAge:
+                return frozenset(entry["accounts"]), frozenset(entry["vendors"])
+        except (KeyError, TypeError):
+            # a malformed entry is treated as a miss and replaced below
+            pass
+
+    validAccounts, validVendors = LoadListsFromQB(sessionManager)
 
-    first_trans = transactions[0]
-    missing_keys = []
+    cache[companyFile] = {
+        "timestamp": time.time(),
+        "accounts": sorted(validAccounts),
+        "vendors": sorted(validVendors),
+    }
+    WriteListsCache(cache)
 
+    return validAccounts, validVendors
+
+def LoadLists(
+    sessionManager: qb.IQBSessionManager,
+) -> tuple[frozenset[str], frozenset[str]]:
+    """Load lists for the open company file, reusing any already loaded by this run."""
+    companyFile = sessionManager.GetCurrentCompanyFileName()
+    if companyFile not in LOADED_LISTS:
+        LOADED_LISTS[companyFile] = LoadCachedLists(sessionManager, companyFile)
+
+    return LOADED_LISTS[companyFile]
+
+def ForgetLists(sessionManager: qb.IQBSessionManager) -> None:
+    """Drop the lists for the open company file, so the next load queries QuickBooks."""
+    companyFile = sessionManager.GetCurrentCompanyFileName()
+    LOADED_LISTS.pop(companyFile, None)
+
+    cache = ReadListsCache()
+    if cache.pop(companyFile, None) is not None:
+        WriteListsCache(cache)
+
+def SplitKeys(maxSplits: int | None) -> list[tuple[str, str, str, str]]:
+    """Column names (gl code id, description, amount, tax amount) for each split line item."""
+    return [
+        (
+            f"line item {i} gl code id",
+            f"line item {i} description",
+            f"line item {i} amount",
+            f"line item {i} tax amount",
+        )
+        for i in range(1, (maxSplits or 0) + 1)
+    ]
+
+def VerifyCSVKeys(columns: dict[str, int], reimbursement: bool, maxSplits: int | None = None) -> bool:
+    """Verify that all required keys exist in the CSV header."""
     # Common required keys for both types
     required_keys = ["description"]
 
@@ -85,213 +245,318 @@ def VerifyCSVKeys(transactions: list[dict], reimbursement: bool, maxSplits: int
         ])
         
         # Split transaction keys if needed
-        if maxSplits:
-            for i in range(1, maxSplits + 1):
-                split_keys = [
-                    f"line item {i} gl code id",
-                    f"line item {i} description",
-                    f"line item {i} amount",
-                    f"line item {i} tax amount"
-                ]
-                required_keys.extend(split_keys)
+        required_keys.extend(itertools.chain.from_iterable(SplitKeys(maxSplits)))
 
     # Check for missing keys
-    for key in required_keys:
-        if key not in first_trans:
-            missing_keys.append(key)
-
+    missing_keys = frozenset(required_keys).difference(columns)
     if missing_keys:
-        Error(f"Missing required keys in CSV: {', '.join(missing_keys)}")
+        Error(f"Missing required keys in CSV: {', '.join(sorted(missing_keys))}")
         return False
 
     return True
 
 def PreCheck(
     sessionManager: qb.IQBSessionManager,
-    transactions: list[dict],
+    transactions: Iterable[list[str]],
+    columns: dict[str, int],
     reimbursement: bool,
     maxSplits: int | None = None,
+    failFast: bool = False,
 ) -> bool:
-    """Pre-check the CSV file for valid accounts and vendors."""
-    validAccounts, validVendors = LoadListsFromQB(sessionManager)
+    """Pre-check the CSV file for valid accounts, vendors, dates and amounts, optionally stopping at the first bad one."""
+    validAccounts, validVendors = LoadLists(sessionManager)
+
+    # collect each bad value once, however many transactions use it
+    badVendors: set[str] = set()
+    badAccounts: set[str] = set()
+    badValues: set[tuple[str, str]] = set()
+    emptyVendors = 0
+    badRows = 0
 
-    good = True
+    # the header's width; the last column always maps to its own index, even if names repeat
+    rowLength = max(columns.values()) + 1
 
     vendorName = "requester" if reimbursement else "accounting vendor name"
+
+    # the columns the import pass parses on every row, with their parsers,
+    # so a bad date or amount is caught before any batch is sent
+    if reimbursement:
+        valueColumns = [
+            ("expense date", ParseExpenseDate),
+            ("total", ParseAmount),
+            ("subtotal", ParseAmount),
+            ("tax", ParseAmount),
+        ]
+    else:
+        valueColumns = [
+            ("transaction date", ParseTransactionDate),
+            ("transaction subtotal dollars", ParseAmount),
+            ("transaction tax dollars", ParseAmount),
+        ]
+    valueColumns = [(name, columns[name], parse) for name, parse in valueColumns]
+
+    # look up the column indexes once for the whole file
+    iVendor = columns[vendorName]
+    iGlcode = columns["gl code id"]
+    splitColumns = [
+        (columns[glKey], columns[amountKey], amountKey, columns[taxKey], taxKey)
+        for glKey, _, amountKey, taxKey in SplitKeys(maxSplits)
+    ]
     
     # loop through transactions and check for bad accounts and vendors
     for t in transactions:
-        if t[vendorName] not in validVendors:
-            Error(f'Invalid {vendorName}: "{t[vendorName]}"')
-            good = False
-
-        if maxSplits and t['line item 1 amount'] != "": # if the csv has splits, check if this transaction does
-            for i in range(1, maxSplits + 1):
-                if t[f"line item {i} amount"] != "": # the determining factor for whether a split exist is if it has an amount
-                    if t[f"line item {i} gl code id"] not in validAccounts:
-                        Error(f'Invalid gl code id: "{t[f"line item {i} gl code id"]}" in split {i} in transaction for {t[vendorName]}')
-                        good = False
-        else: # this transaction doesn't have splits
-            if t["gl code id"] not in validAccounts:
-                Error(f'Invalid gl code id: {t["gl code id"]} in transaction for {t[vendorName]}')
-                good = False
-
-    return good
+        # a short or long row would only fail part way through the import
+        if len(t) != rowLength:
+            badRows += 1
+            if failFast:
+                break
+            continue
 
+        vendor = t[iVendor]
+        if not vendor: # blank names are counted and reported once, not as an invalid vendor
+            emptyVendors += 1
+        elif vendor not in validVendors:
+            badVendors.add(vendor)
+
+        if splitColumns and t[splitColumns[0][1]] != "": # if the csv has splits, check if this transaction does
+            for iSplitGlcode, iSplitAmount, _, _, _ in splitColumns:
+                if t[iSplitAmount] != "": # the determining factor for whether a split exist is if it has an amount
+                    account = t[iSplitGlcode]
+                    if account not in validAccounts:
+                        badAccounts.add(account)
+        else: # this transaction doesn't have splits
+            account = t[iGlcode]
+            if account not in validAccounts:
+                badAccounts.add(account)
+
+        # parse the same values ProcessTransactions/ProcessReimbursements will
+        for name, i, parse in valueColumns:
+            try:
+                parse(t[i])
+            except ValueError:
+                badValues.add((name, t[i]))
+        if splitColumns and not t[iGlcode]:
+            for iSplitGlcode, iSplitAmount, amountKey, iSplitTax, taxKey in splitColumns:
+                if not t[iSplitGlcode]:
+                    break
+                for name, i in ((amountKey, iSplitAmount), (taxKey, iSplitTax)):
+                    try:
+                        ParseAmount(t[i])
+                    except ValueError:
+                        badValues.add((name, t[i]))
+
+        if failFast and (emptyVendors or badVendors or badAccounts or badValues):
+            break
+
+    if badVendors or badAccounts:
+        # the lists may predate a fix made in QuickBooks, so don't trust them next time
+        ForgetLists(sessionManager)
+
+    if badRows:
+        Error(f"{badRows} rows don't have the {rowLength} columns in the header")
+    if emptyVendors:
+        Error(f"{emptyVendors} rows have an empty {vendorName}")
+    for vendor in sorted(badVendors):
+        Error(f'Invalid {vendorName}: "{vendor}"')
+    for account in sorted(badAccounts):
+        Error(f'Invalid gl code id: "{account}"')
+    for name, value in sorted(badValues):
+        Error(f'Invalid {name}: "{value}"')
+
+    return not badRows and not emptyVendors and not badVendors and not badAccounts and not badValues
 
 def WalkRs(respMsgSet: qb.IMsgSetResponse) -> bool:
     """Walk the response message set."""
     
     Success: bool = True
-    if respMsgSet.responseList is None:
+    responseList = respMsgSet.responseList
+    if responseList is None:
+        return True
+
+    # in the usual case where everything succeeded, report a single summary
+    # instead of fetching the details of every transaction from QuickBooks
+    responses = list(responseList)
+    statusCodes = [resp.StatusCode for resp in responses]
+    if not any(statusCodes):
+        click.echo(f"Created {len(responses)} transactions in QuickBooks")
         return True
 
-    for resp in respMsgSet.responseList:
-        if resp.StatusCode >0:
-            Error(f"Error: Code:{resp.StatusCode} Severity: {resp.StatusSeverity} Message: {resp.StatusMessage}")
+    for resp, statusCode in zip(responses, statusCodes):
+        if statusCode >0:
+            Error(f"Error: Code:{statusCode} Severity: {resp.StatusSeverity} Message: {resp.StatusMessage}")
             Success = False
-        if resp.StatusCode >= 0 and resp.Detail is not None:
+        detail = resp.Detail
+        if statusCode >= 0 and detail is not None:
             respType = int(resp.Type.GetValue())
-            if respType == qb.ENResponseType.rtDepositAddRs:
-                depositRet: qb.IDepositRet = qb.IDepositRet(resp.Detail)
-                WalkDepositRet(depositRet, resp.StatusCode, resp.StatusSeverity, resp.StatusMessage)
-            elif respType == qb.ENResponseType.rtCheckAddRs:
-                checkRet: qb.ICheckRet = qb.ICheckRet(resp.Detail)
-                WalkCheckRet(checkRet, resp.StatusCode, resp.StatusSeverity, resp.StatusMessage)
-            elif respType == qb.ENResponseType.rtBillAddRs:
-                billRet: qb.IBillRet = qb.IBillRet(resp.Detail)
-                WalkBillRet(billRet, resp.StatusCode, resp.StatusSeverity, resp.StatusMessage)
-            else:
+            spec = RESPONSE_SPECS.get(respType)
+            if spec is None:
                 Error(f"Unknown response type {qb.ENResponseType(respType).name}")
                 Success = False
+            else:
+                WalkTxnRet(spec.retType(detail), spec, statusCode)
     return Success
 
-def WalkBillRet(billRet: qb.IBillRet, statusCode: int, statusSeverity: str, statusMessage: str) -> None:
-    """Walk the bill return."""
-    if billRet is None:
-        return
-
-    # Get value of TxnDate
-    txnDate = billRet.TxnDate.GetValue()
-    txnToAccount = billRet.VendorRef.FullName.GetValue()
-    txnMemo = billRet.Memo.GetValue() if billRet.Memo is not None else ""
-    txnTotal = billRet.AmountDue.GetValue()
+class TxnSpec(NamedTuple):
+    """Where to find the details of one kind of add response."""
+    retType: type
+    label: str
+    accountAttr: str
+    totalAttr: str
+    lineListAttr: str
+    lineListType: type
+    describe: Callable[[Any, str, str], str]
+
+def WalkTxnRet(txnRet: Any, spec: TxnSpec, statusCode: int) -> None:
+    """Walk a bill, deposit or cheque return."""
+    txnAccount = getattr(txnRet, spec.accountAttr).FullName.GetValue()
+    txnTotal = FormatCurrency(getattr(txnRet, spec.totalAttr).GetValue())
 
     if statusCode == 0:
-        click.echo(f"Created bill from {txnToAccount} for {locale.currency(txnTotal, grouping=True)}")
-    else:
-        if billRet.ExpenseLineRetList is not None:
-            expenseLineRetList = qb.IExpenseLineRetList(billRet.ExpenseLineRetList)
-            for expenseLineRet in expenseLineRetList:
-                lineAccount = ""
-                if expenseLineRet.AccountRef is not None:
-                    accountRef = expenseLineRet.AccountRef
-                    lineAccount = accountRef.FullName.GetValue()
-                lineMemo = expenseLineRet.Memo.GetValue()
-                lineAmount = expenseLineRet.Amount.GetValue()
-                Error(
-                    f"Error creating Bill {txnDate} {txnToAccount} {txnMemo} {locale.currency(txnTotal, grouping=True)} {lineAccount} "
-                    f"{lineMemo} {locale.currency(lineAmount, grouping=True)}"
-                )
-
-
-def WalkDepositRet(depositRet: qb.IDepositRet, statusCode: int, statusSeverity: str, statusMessage: str) -> None:
-    """Walk the deposit return."""
-    if depositRet is None:
+        click.echo(spec.describe(txnRet, txnAccount, txnTotal))
         return
 
     # Get value of TxnDate
-    txnDate = depositRet.TxnDate.GetValue()
-    txnToAccount = depositRet.DepositToAccountRef.FullName.GetValue()
-    txnMemo = depositRet.Memo.GetValue() if depositRet.Memo is not None else ""
-    txnTotal = depositRet.DepositTotal.GetValue()
+    txnDate = txnRet.TxnDate.GetValue()
+    memo = txnRet.Memo
+    txnMemo = memo.GetValue() if memo is not None else ""
 
-    if statusCode == 0:
-        click.echo(f"Created deposit to {txnToAccount} for {locale.currency(txnTotal, grouping=True)}")
-    else:
-        if depositRet.depositLineRetList is not None:
-            for depositLineRet in depositRet.depositLineRetList:
-                lineAccount = ""
-                if depositLineRet.AccountRef is not None:
-                    accountRef = depositLineRet.AccountRef
-                    lineAccount = accountRef.FullName.GetValue()
-                lineMemo = depositLineRet.Memo.GetValue()
-                lineAmount = depositLineRet.Amount.GetValue()
-                Error(
-                    f"Error creating Deposit {txnDate} {txnToAccount} {txnMemo} {locale.currency(txnTotal, grouping=True)} {lineAccount} "
-                    f"{lineMemo} {locale.currency(lineAmount, grouping=True)}"
-                )
-
-
-def WalkCheckRet(checkRet: qb.ICheckRet, statusCode: int, statusSeverity: str, statusMessage: str) -> None:
-    """Walk the check return."""
-    if checkRet is None:
+    lineRetList = getattr(txnRet, spec.lineListAttr)
+    if lineRetList is None:
         return
-
-    # Get value of TxnDate
-    txnDate = checkRet.TxnDate.GetValue()
-    txnToAccount = checkRet.AccountRef.FullName.GetValue()
-    txnMemo = checkRet.Memo.GetValue() if checkRet.Memo is not None else ""
-    txnTotal = checkRet.Amount.GetValue()
-    txnRefNumber = checkRet.RefNumber.GetValue()
-    txnPayee = checkRet.PayeeEntityRef.FullName.GetValue()
-
-    if statusCode == 0:
-        click.echo(f"Created cheque Number {txnRefNumber} to {txnPayee} for {locale.currency(txnTotal, grouping=True)}")
-    else:
-        if checkRet.ExpenseLineRetList is not None:
-            expenseLineRetList = qb.IExpenseLineRetList(checkRet.ExpenseLineRetList)
-            for expenseLineRet in expenseLineRetList:
-                lineAccount = ""
-                if expenseLineRet.AccountRef is not None:
-                    accountRef = expenseLineRet.AccountRef
-                    lineAccount = accountRef.FullName.GetValue()
-                lineMemo = expenseLineRet.Memo.GetValue()
-                lineAmount = expenseLineRet.Amount.GetValue()
-                Error(
-                    f"Error creating Cheque {txnDate} {txnToAccount} {txnMemo} {locale.currency(txnTotal,    grouping=True)} {lineAccount} "
-                    f"{lineMemo} {locale.currency(lineAmount, grouping=True)}"
-                )
-
+    for lineRet in spec.lineListType(lineRetList):
+        lineAccount = ""
+        accountRef = lineRet.AccountRef
+        if accountRef is not None:
+            lineAccount = accountRef.FullName.GetValue()
+        lineMemo = lineRet.Memo.GetValue()
+        lineAmount = lineRet.Amount.GetValue()
+        Error(
+            f"Error creating {spec.label} {txnDate} {txnAccount} {txnMemo} {txnTotal} {lineAccount} "
+            f"{lineMemo} {FormatCurrency(lineAmount)}"
+        )
+
+
+# how to walk each kind of add response
+RESPONSE_SPECS = {
+    qb.ENResponseType.rtDepositAddRs: TxnSpec(
+        qb.IDepositRet, "Deposit", "DepositToAccountRef", "DepositTotal",
+        "DepositLineRetList", qb.IDepositLineRetList,
+        lambda ret, account, total: f"Created deposit to {account} for {total}",
+    ),
+    qb.ENResponseType.rtCheckAddRs: TxnSpec(
+        qb.ICheckRet, "Cheque", "AccountRef", "Amount",
+        "ExpenseLineRetList", qb.IExpenseLineRetList,
+        lambda ret, account, total: (
+            f"Created cheque Number {ret.RefNumber.GetValue()} to {ret.PayeeEntityRef.FullName.GetValue()} for {total}"
+        ),
+    ),
+    qb.ENResponseType.rtBillAddRs: TxnSpec(
+        qb.IBillRet, "Bill", "VendorRef", "AmountDue",
+        "ExpenseLineRetList", qb.IExpenseLineRetList,
+        lambda ret, account, total: f"Created bill from {account} for {total}",
+    ),
+}
+
+
+def AddDeposit(
+    requestMsgSet: qb.IMsgSetRequest,
+    txnDate: datetime,
+    glcode: str,
+    amount: float,
+    memo: str,
+) -> None:
+    """Append a deposit into the Float account to the request message set."""
+    depAddRq = qb.IDepositAdd(requestMsgSet.AppendDepositAddRq())
+    depAddRq.DepositToAccountRef.FullName.SetValue(FLOAT_ACCOUNT)
+    depAddRq.TxnDate.SetValue(txnDate)
+    depAddRq.Memo.SetValue(memo)
+    depLineAddRq: qb.IDepositLineAdd = depAddRq.DepositLineAddList.Append()
+    depositInfo = depLineAddRq.ORDepositLineAdd.DepositInfo
+    depositInfo.AccountRef.FullName.SetValue(glcode)
+    depositInfo.Amount.SetValue(amount)
+
+def AddCheck(
+    requestMsgSet: qb.IMsgSetRequest,
+    txnDate: datetime,
+    payee: str,
+    memo: str,
+    lineItems: list[dict],
+    tax: float,
+) -> None:
+    """Append a cheque from the Float account to the request message set."""
+    chkAddRq = qb.ICheckAdd(requestMsgSet.AppendCheckAddRq())
+    chkAddRq.AccountRef.FullName.SetValue(FLOAT_ACCOUNT)
+    chkAddRq.IsToBePrinted.SetValue(False)
+    chkAddRq.TxnDate.SetValue(txnDate)
+    chkAddRq.PayeeEntityRef.FullName.SetValue(payee)
+    chkAddRq.Memo.SetValue(memo)
+
+    # fetch the line list once rather than once per line
+    expenseLines = chkAddRq.ExpenseLineAddList
+    for item in lineItems:
+        expAdd: qb.IExpenseLineAdd = expenseLines.Append()
+        expAdd.AccountRef.FullName.SetValue(item['glcode'])
+        expAdd.Amount.SetValue(item['total'])
+        expAdd.Memo.SetValue(item['description'])
+
+    if tax != 0:
+        expAddT: qb.IExpenseLineAdd = expenseLines.Append()
+        expAddT.AccountRef.FullName.SetValue(GST_ACCOUNT)
+        expAddT.Amount.SetValue(tax)
+        expAddT.Memo.SetValue(GST_MEMO)
 
 def ProcessTransactions(
     sessionManager: qb.IQBSessionManager,
-    transactions: list[dict],
+    transactions: Iterable[list[str]],
+    columns: dict[str, int],
     maxSplits: int | None,
-) -> tuple[int, qb.IMsgSetResponse]:
-    """Process the transaction data."""
-    requestMsgSet = sessionManager.CreateMsgSetRequest("CA", 16, 0)
-    requestMsgSet.Attributes.OnError = qb.constants.roeContinue
+) -> tuple[int, bool]:
+    """Process the transaction data, sending it to QuickBooks in batches."""
+    requestMsgSet = NewMsgSetRequest(sessionManager)
+
+    # look up the column indexes once for the whole file
+    getFields = operator.itemgetter(
+        columns["transaction date"],
+        columns["accounting vendor name"],
+        columns["transaction subtotal dollars"],
+        columns["gl code id"],
+        columns["transaction tax dollars"],
+        columns["description"],
+    )
+    splitColumns = [tuple(columns[key] for key in keys) for keys in SplitKeys(maxSplits)]
 
     count = 0
-    for trans in transactions:
-        trnsDate = datetime.strptime(trans["transaction date"], "%Y-%m-%d %H:%M:%S.%f%z")
-        trnsMerch = trans["accounting vendor name"]
-        trnsTotal = float(trans["transaction subtotal dollars"])
-        trnsGlcode = trans["gl code id"]
-        trnsTax = float(trans["transaction tax dollars"])
-        trnsDesc = trans["description"]
-
-        lineItems = []
-        # if the file has any transactions with splits...
-        if (not maxSplits) or trnsGlcode > "":
-            # if this particular transaction has no splits
-            lineItems.append({
-                        'description': trnsDesc,
-                        'total': trnsTotal,
-                        'tax': trnsTax,
-                        'glcode': trnsGlcode
-                    })
-        else:
-            # if this particular transaction has splits
-            for item in range(1, maxSplits + 1):
-                # is there another split
-                if trans.get(f"line item {item} gl code id", "") > "":
+    sent = 0
+    success = True
+    try:
+        for trans in transactions:
+            trnsDate, trnsMerch, trnsTotal, trnsGlcode, trnsTax, trnsDesc = getFields(trans)
+            trnsDate = ParseTransactionDate(trnsDate)
+            trnsTotal = ParseAmount(trnsTotal)
+            trnsTax = ParseAmount(trnsTax)
+
+            lineItems = []
+            # if the file has any transactions with splits...
+            if (not maxSplits) or trnsGlcode > "":
+                # if this particular transaction has no splits
+                lineItems.append({
+                            'description': trnsDesc,
+                            'total': trnsTotal,
+                            'tax': trnsTax,
+                            'glcode': trnsGlcode
+                        })
+            else:
+                # if this particular transaction has splits
+                for iSplitGlcode, iSplitDesc, iSplitAmount, iSplitTax in splitColumns:
+                    # splits are filled in order, so the first empty one ends the list
+                    splitGLCode = trans[iSplitGlcode]
+                    if not splitGLCode:
+                        break
+
                     # Find corresponding fields for this line item
-                    splitDesc = trans.get(f"line item {item} description", "")
-                    splitTotal = float(trans.get(f"line item {item} amount", 0))
-                    splitTax = float(trans.get(f"line item {item} tax Amount", 0))
-                    splitGLCode = trans.get(f"line item {item} gl code id", "")
+                    splitDesc = trans[iSplitDesc]
+                    splitTotal = ParseAmount(trans[iSplitAmount])
+                    splitTax = ParseAmount(trans[iSplitTax])
 
                     lineItems.append({
                         'description': splitDesc,
@@ -300,167 +565,221 @@ def ProcessTransactions(
                         'glcode': splitGLCode
                     })
 
-        if not lineItems:
-            Error("Transaction has no detectable amounts or splits.")
-            continue
+            if not lineItems:
+                Error("Transaction has no detectable amounts or splits.")
+                continue
 
-        # if this is a deposit
-        if trnsTotal < 0:
-            # trnsType = "DEPOSIT"
-            depAddRq = qb.IDepositAdd(requestMsgSet.AppendDepositAddRq())
-            depAddRq.DepositToAccountRef.FullName.SetValue("Float Financial")
-            depAddRq.TxnDate.SetValue(trnsDate)
-            depAddRq.Memo.SetValue(trnsDesc)
-            depLineAddRq: qb.IDepositLineAdd = depAddRq.DepositLineAddList.Append()
-            depositInfo = depLineAddRq.ORDepositLineAdd.DepositInfo
-            depositInfo.AccountRef.FullName.SetValue(trnsGlcode)
-            depositInfo.Amount.SetValue(-1 * trnsTotal)
-        else:
-            # trnsType = "CHEQUE"
-            chkAddRq = qb.ICheckAdd(requestMsgSet.AppendCheckAddRq())
-            chkAddRq.AccountRef.FullName.SetValue("Float Financial")
-            chkAddRq.IsToBePrinted.SetValue(False)
-            chkAddRq.TxnDate.SetValue(trnsDate)
-            chkAddRq.PayeeEntityRef.FullName.SetValue(trnsMerch)
-            chkAddRq.Memo.SetValue(trnsDesc)
-
-            for item in lineItems:
-                expAdd: qb.IExpenseLineAdd = chkAddRq.ExpenseLineAddList.Append()
-                expAdd.AccountRef.FullName.SetValue(item['glcode'])
-                expAdd.Amount.SetValue(item['total'])
-                expAdd.Memo.SetValue(item['description'])
+            # a negative total is money coming back to the card, so it is a deposit
+            if trnsTotal < 0:
+                AddDeposit(requestMsgSet, trnsDate, trnsGlcode, -trnsTotal, trnsDesc)
+            else:
+                AddCheck(requestMsgSet, trnsDate, trnsMerch, trnsDesc, lineItems, trnsTax)
 
-            if trnsTax != 0:
-                expAddT: qb.IExpenseLineAdd = chkAddRq.ExpenseLineAddList.Append()
-                expAddT.AccountRef.FullName.SetValue("GST Accounts Receivable")
-                expAddT.Amount.SetValue(trnsTax)
-                expAddT.Memo.SetValue("Half of the GST")
+            count += 1
 
-        count += 1
+            # send each full batch as soon as it is ready
+            if count % BATCH_SIZE == 0:
+                success = SubmitRequests(sessionManager, requestMsgSet) and success
+                sent = count
+                requestMsgSet = NewMsgSetRequest(sessionManager)
 
-    respMsgSet = qb.IMsgSetResponse(sessionManager.DoRequests(requestMsgSet))
+        # send whatever is left over in the last partial batch
+        if count % BATCH_SIZE:
+            success = SubmitRequests(sessionManager, requestMsgSet) and success
+    except Exception:
+        # earlier batches are already in QuickBooks, so importing the file again would duplicate them
+        if sent:
+            Error(f"{sent} transactions were already sent to QuickBooks before this error")
+        raise
 
-    return count, respMsgSet
+    return count, success
 
 def ProcessReimbursements(
     sessionManager: qb.IQBSessionManager,
-    transactions: list[dict],
-) -> tuple[int, qb.IMsgSetResponse]:
-    """Process the transaction data."""
-    requestMsgSet = sessionManager.CreateMsgSetRequest("CA", 16, 0)
-    requestMsgSet.Attributes.OnError = qb.constants.roeContinue
+    transactions: Iterable[list[str]],
+    columns: dict[str, int],
+) -> tuple[int, bool]:
+    """Process the reimbursement data, sending it to QuickBooks in batches."""
+    requestMsgSet = NewMsgSetRequest(sessionManager)
+
+    # look up the column indexes once for the whole file
+    getFields = operator.itemgetter(
+        columns["expense date"],
+        columns["description"],
+        columns["requester"],
+        columns["gl code id"],
+        columns["total"],
+        columns["subtotal"],
+        columns["tax"],
+    )
 
     count = 0
-    for trans in transactions:
-        trnsDate = datetime.strptime(trans["expense date"], "%d/%m/%Y")
-
-        trnsDesc = trans["description"].strip()
-        trnsMerch = trans["requester"]
-        trnsGlcode = trans["gl code id"]
-
-        try:
-            trnsAmount = float(trans.get("total", 0))
-            trnsSubtotal = float(trans.get("subtotal", 0))
-            trnsTax = float(trans.get("tax", 0))
-        except ValueError:
-            Error("Invalid number format in transaction.")
-            continue
-
-        # trnsType = "BILL"
-        billAddRq = qb.IBillAdd(requestMsgSet.AppendBillAddRq())
-        billAddRq.APAccountRef.FullName.SetValue("Accounts Payable")
-        billAddRq.TxnDate.SetValue(trnsDate)
-        billAddRq.VendorRef.FullName.SetValue(trnsMerch)
-        billAddRq.Memo.SetValue(trnsDesc)
-
-        expAdd: qb.IExpenseLineAdd = billAddRq.ExpenseLineAddList.Append()
-        expAdd.AccountRef.FullName.SetValue(trnsGlcode)
-        expAdd.Amount.SetValue(trnsSubtotal)
-        expAdd.Memo.SetValue(trnsDesc)
-        if trnsTax != 0:
-            expAddT: qb.IExpenseLineAdd = billAddRq.ExpenseLineAddList.Append()
-            expAddT.AccountRef.FullName.SetValue("GST Accounts Receivable")
-            expAddT.Amount.SetValue(trnsTax)
-            expAddT.Memo.SetValue("Half of the GST")
-
-        count += 1
-
-    respMsgSet = qb.IMsgSetResponse(sessionManager.DoRequests(requestMsgSet))
+    sent = 0
+    success = True
+    try:
+        for trans in transactions:
+            trnsDate, trnsDesc, trnsMerch, trnsGlcode, trnsAmount, trnsSubtotal, trnsTax = getFields(trans)
+            trnsDate = ParseExpenseDate(trnsDate)
+            trnsDesc = trnsDesc.strip()
+
+            # PreCheck has already rejected the file if any of these don't parse
+            trnsAmount = ParseAmount(trnsAmount)
+            trnsSubtotal = ParseAmount(trnsSubtotal)
+            trnsTax = ParseAmount(trnsTax)
+
+            # trnsType = "BILL"
+            billAddRq = qb.IBillAdd(requestMsgSet.AppendBillAddRq())
+            billAddRq.APAccountRef.FullName.SetValue(AP_ACCOUNT)
+            billAddRq.TxnDate.SetValue(trnsDate)
+            billAddRq.VendorRef.FullName.SetValue(trnsMerch)
+            billAddRq.Memo.SetValue(trnsDesc)
+
+            expenseLines = billAddRq.ExpenseLineAddList
+            expAdd: qb.IExpenseLineAdd = expenseLines.Append()
+            expAdd.AccountRef.FullName.SetValue(trnsGlcode)
+            expAdd.Amount.SetValue(trnsSubtotal)
+            expAdd.Memo.SetValue(trnsDesc)
+            if trnsTax != 0:
+                expAddT: qb.IExpenseLineAdd = expenseLines.Append()
+                expAddT.AccountRef.FullName.SetValue(GST_ACCOUNT)
+                expAddT.Amount.SetValue(trnsTax)
+                expAddT.Memo.SetValue(GST_MEMO)
+
+            count += 1
+
+            # send each full batch as soon as it is ready
+            if count % BATCH_SIZE == 0:
+                success = SubmitRequests(sessionManager, requestMsgSet) and success
+                sent = count
+                requestMsgSet = NewMsgSetRequest(sessionManager)
+
+        # send whatever is left over in the last partial batch
+        if count % BATCH_SIZE:
+            success = SubmitRequests(sessionManager, requestMsgSet) and success
+    except Exception:
+        # earlier batches are already in QuickBooks, so importing the file again would duplicate them
+        if sent:
+            Error(f"{sent} transactions were already sent to QuickBooks before this error")
+        raise
+
+    return count, success
+
+
+def ExpandInputFiles(inputPaths: Iterable[str]) -> list[Path]:
+    """Expand any folders in the input paths to the CSV files they contain, listing each file once."""
+    inputFiles = {}
+    for inputPath in map(Path, inputPaths):
+        paths = sorted(inputPath.glob("*.csv")) if inputPath.is_dir() else [inputPath]
+        for path in paths:
+            # a file named directly and through its folder must only be imported once
+            inputFiles.setdefault(path.resolve(), path)
+
+    return list(inputFiles.values())
+
+def HasTransactions(inputFilePath: Path) -> bool:
+    """Check that a CSV file has at least one transaction, without reading the rest of it."""
+    rows = ReadTransactions(inputFilePath)
+    try:
+        hasRows = next(rows, None) is not None
+    except (OSError, UnicodeDecodeError, csv.Error) as e:
+        # report this file and carry on with the others
+        Error(f"Could not read {inputFilePath}: {e}")
+        return False
+    finally:
+        rows.close()
 
-    return count, respMsgSet
+    if not hasRows:
+        Error(f"No transactions found in {inputFilePath}")
 
+    return hasRows
 
-def ProcessFile(inputFileName):
-    """Main processing function that handles the CSV import to QB"""
+def ProcessFile(sessionManager: qb.IQBSessionManager, inputFileName) -> bool:
+    """Main processing function that handles the CSV import to QB, returning True on success"""
     count = 0
     inputFilePath = Path(inputFileName)
 
     try:
-        with open(inputFilePath, "r", encoding="utf-8-sig") as inputFile:
-            csvReader = csv.DictReader(inputFile)
+        # only the header is needed to work out what kind of file this is;
+        # the rows are streamed from the file again for each pass below
+        columns = ReadColumns(inputFilePath)
 
-            # load the full set of transactions into memory
-            transactions = [KeysLower(d) for d in list(csvReader)]
-
-        if "report name" in transactions[0]:
+        if "report name" in columns:
             # this must be a reimbursement file
             reimbursement = True
             maxSplits = None
         else:
             # this must be a standard transactions file
             reimbursement = False
-            firstLine = transactions[0]
-            pattern = r"^line item (\d+)"
-            splits = [int(match.group(1)) for key in firstLine if (match := re.match(pattern, key))]
+            numbers = [key[len("line item "):].partition(" ")[0] for key in columns if key.startswith("line item ")]
+            splits = [int(number) for number in numbers if number.isdigit()]
             maxSplits = max(splits) if splits else None
 
         # Verify CSV has all required keys
-        if not VerifyCSVKeys(transactions, reimbursement, maxSplits):
-            return
+        if not VerifyCSVKeys(columns, reimbursement, maxSplits):
+            return False
 
-        with qb.IQBSessionManager() as sessionManager:
-            if not PreCheck(sessionManager, transactions, reimbursement, maxSplits):
-                return
+        failFast = click.get_current_context().params['fail_fast']
+        if not PreCheck(sessionManager, ReadTransactions(inputFilePath), columns, reimbursement, maxSplits, failFast):
+            return False
 
-            if reimbursement:
-                count, respMsgSet = ProcessReimbursements(
-                    sessionManager, transactions
-                )
-            else:
-                count, respMsgSet = ProcessTransactions(
-                    sessionManager, transactions, maxSplits
-                )
+        if reimbursement:
+            count, success = ProcessReimbursements(
+                sessionManager, ReadTransactions(inputFilePath), columns
+            )
+        else:
+            count, success = ProcessTransactions(
+                sessionManager, ReadTransactions(inputFilePath), columns, maxSplits
+            )
 
-        # if the response indicates success, prompt the user to delete input file
-        if WalkRs(respMsgSet):
+        if success:
             click.echo(f"Conversion complete, processed {count} transactions from {inputFileName}")
-
-            if click.confirm("Would you like to delete the input file?"):
-                os.remove(inputFilePath) # delete the input file
         else:
             click.echo("Failed to import transactions to QuickBooks", err=True)
+
+        return success
             
     except Exception as e:
         Error(f"Failed to process {inputFileName}: {e}")
+        return False
 
 @click.command()
-@click.argument('input_file', type=click.Path(exists=True, dir_okay=False), required=False)
+@click.argument('input_files', type=click.Path(exists=True), nargs=-1)
 @click.option('--debug/--no-debug', default=False, help='Enable debug mode with full traceback')
-def main(input_file, debug):
-    """Import Float CSV file to QuickBooks.
+@click.option('--refresh-lists', is_flag=True, default=False, help='Reload accounts and vendors from QuickBooks instead of the cache')
+@click.option('--lists-ttl', type=click.IntRange(min=0), default=LISTS_CACHE_TTL, show_default=True, help='Minutes to reuse cached accounts and vendors')
+@click.option('--fail-fast', is_flag=True, default=False, help='Stop checking a file at the first bad row')
+def main(input_files, debug, refresh_lists, lists_ttl, fail_fast):
+    """Import Float CSV files to QuickBooks.
     
-    INPUT_FILE: Path to the CSV file to process
+    INPUT_FILES: Paths to the CSV files to process, or folders of CSV files
     """
-    if not input_file:
+    if not input_files:
         input_file = click.prompt('Please enter the path to your Float CSV file', type=str).strip().strip('"')
         if not os.path.exists(input_file):
             Error(f"Error: File '{input_file}' does not exist.")
             click.prompt('Press Enter to exit', default='', show_default=False)
             sys.exit(1)
+        input_files = (input_file,)
 
     try:
         locale.setlocale(locale.LC_ALL, 'en_CA')
-        ProcessFile(input_file)
+
+        # skip empty files up front, so QuickBooks isn't opened for nothing
+        inputFiles = [f for f in ExpandInputFiles(input_files) if HasTransactions(f)]
+
+        # open a single QuickBooks session and share it between all the files
+        importedFiles = []
+        if inputFiles:
+            with qb.IQBSessionManager() as sessionManager:
+                for inputFilePath in inputFiles:
+                    if ProcessFile(sessionManager, inputFilePath):
+                        importedFiles.append(inputFilePath)
+
+        # the session is closed before prompting, so QuickBooks isn't held
+        # open while waiting on the user
+        for inputFilePath in importedFiles:
+            if click.confirm(f"Would you like to delete the input file {inputFilePath}?"):
+                inputFilePath.unlink()
         click.prompt('Press Enter to exit', default='', show_default=False)
     except Exception as e:
         Error(f"Error: {str(e)}")
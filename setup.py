@@ -6,10 +6,14 @@ py2exe_options = {
                 "packages": ["click"],
                 "includes": ["click", "click.core", "click.decorators", "click.parser", "click.termui", "click.types"],
                 "excludes": ["_ssl",  # Exclude _ssl
-                        'pyreadline', 'difflib', 'doctest', 'optparse', 
-                        "Tkconstants","Tkinter","tcl"],  # Exclude some standard libraries
+                        'pyreadline', 'difflib', 'doctest', 'optparse',
+                        "Tkconstants","Tkinter","tcl",  # Exclude some standard libraries
+                        # nothing on the import path uses these
+                        "tkinter", "unittest", "pdb", "pydoc", "email", "http", "xml", "xmlrpc",
+                        "asyncio", "concurrent", "multiprocessing", "sqlite3", "lib2to3"],
+                "optimize": 1,  # strip asserts only; click builds --help from docstrings
                 "compressed": True,  # Compress library.zip
                 }
 
 freeze(console=['Float2QB.py'],
-       options={'py2exe': py2exe_options}) 
\ No newline at end of file
+       options={'py2exe': py2exe_options})